@@ -1,4 +1,5 @@
 from typing import Optional
+import asyncio
 import os
 from pathlib import Path
 import certifi
@@ -14,10 +15,46 @@ load_dotenv(dotenv_path=env_path)
 
 MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME", "wheel_city")
+DEBUG_DB = os.getenv("DEBUG_DB", "").lower() in ("1", "true", "yes")
+
+# 커넥션 풀 설정 (기본값 100/0/무제한 대신 ASGI 동시성에 맞춰 명시)
+MONGO_MAX_POOL = int(os.getenv("MONGO_MAX_POOL", "200"))
+MONGO_MIN_POOL = int(os.getenv("MONGO_MIN_POOL", "10"))
+MONGO_MAX_IDLE_MS = int(os.getenv("MONGO_MAX_IDLE_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
+# CA 번들 경로와 클라이언트 옵션은 import 시 한 번만 계산
+_CA_FILE = certifi.where()
+_CLIENT_KW = {
+    "tlsCAFile": _CA_FILE,
+    "maxPoolSize": MONGO_MAX_POOL,
+    "minPoolSize": MONGO_MIN_POOL,
+    "maxIdleTimeMS": MONGO_MAX_IDLE_MS,
+    "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+}
+
+# 시작 시 보장할 인덱스: (collection, keys, options)
+INDEXES = [
+    ("shops", [("name", "text")], {}),
+    ("shops", [("location", "2dsphere")], {}),
+    # 리뷰 목록 keyset 페이지네이션 + 최근 리뷰 조회: _id 역순 (메모리 정렬 없음)
+    ("reviews", [("shop_id", 1), ("_id", -1)], {}),
+    ("reviews", [("user_id", 1), ("_id", -1)], {}),
+    # get-or-create / create_user 중복 방지 (kakao_id 없는 사용자는 제외)
+    ("users", [("auth_id", 1)], {"unique": True}),
+    ("users", [("kakao_id", 1)], {
+        "unique": True,
+        "partialFilterExpression": {"kakao_id": {"$type": "string"}},
+    }),
+]
 
 # 전역 클라이언트와 DB 핸들
 _client: Optional[AsyncIOMotorClient] = None
 db = None
+# INDEXES의 unique 인덱스가 모두 생성/확인되었는지 (실패 시 라우터가 직접 중복 검사)
+unique_indexes_ready = False
 
 
 async def connect(*args, **kwargs):
@@ -26,11 +63,11 @@ async def connect(*args, **kwargs):
     """
     global _client, db
     if not MONGO_URI:
-        print(f"❌ MONGO_URI is not set in .env file")
-        print(f"   Looking for .env at: {env_path}")
-        print(f"   .env file exists: {env_path.exists()}")
-        if env_path.exists():
-            print(f"   .env file size: {env_path.stat().st_size} bytes")
+        if DEBUG_DB:
+            print(f"   Looking for .env at: {env_path}")
+            print(f"   .env file exists: {env_path.exists()}")
+            if env_path.exists():
+                print(f"   .env file size: {env_path.stat().st_size} bytes")
         error_msg = (
             "❌ MONGO_URI is not set in .env file. Please check:\n"
             "   1. Variable name is MONGO_URI (all uppercase)\n"
@@ -40,7 +77,7 @@ async def connect(*args, **kwargs):
         raise ValueError(error_msg)
 
     try:
-        _client = AsyncIOMotorClient(MONGO_URI, tlsCAFile=certifi.where())
+        _client = AsyncIOMotorClient(MONGO_URI, **_CLIENT_KW)
         db = _client[DB_NAME]
 
         # 연결 테스트
@@ -50,6 +87,14 @@ async def connect(*args, **kwargs):
         print(f"❌ MongoDB connection failed: {e}")
         _client = None
         db = None
+        return
+
+    # minPoolSize 만큼 동시에 ping 하여 TLS/인증이 끝난 소켓을 미리 확보
+    # (워밍업 실패는 연결 실패가 아니므로 경고만 출력)
+    try:
+        await asyncio.gather(*(db.command("ping") for _ in range(MONGO_MIN_POOL)))
+    except Exception as e:
+        print(f"⚠️ MongoDB pool warmup failed: {e}")
 
 
 async def close():
@@ -59,3 +104,16 @@ async def close():
         _client.close()
         print("🛑 MongoDB connection closed")
 
+
+async def ensure_indexes(database) -> None:
+    """INDEXES에 정의된 인덱스를 생성 (이미 존재하면 no-op)."""
+    global unique_indexes_ready
+    unique_ok = True
+    for collection, keys, options in INDEXES:
+        try:
+            await database[collection].create_index(keys, **options)
+        except Exception as e:
+            print(f"⚠️ Failed to create index on {collection} {keys}: {e}")
+            if options.get("unique"):
+                unique_ok = False
+    unique_indexes_ready = unique_ok
@@ -1,25 +1,33 @@
+import logging
 import os
+import secrets
+from functools import lru_cache
 from pathlib import Path
-from fastapi import Header, HTTPException
+from typing import Optional
+
+from fastapi import Header, HTTPException, Request
+from motor.motor_asyncio import AsyncIOMotorDatabase
 from dotenv import load_dotenv
 
 # Load .env file (same way as db.py does it)
 project_root = Path(__file__).parent.parent
 env_path = project_root / ".env"
-print(f"[DEPS] Loading .env from: {env_path}", flush=True)
-print(f"[DEPS] .env file exists: {env_path.exists()}", flush=True)
-if env_path.exists():
-    print(f"[DEPS] .env file size: {env_path.stat().st_size} bytes", flush=True)
-load_dotenv(dotenv_path=env_path)
-
-# Try both variable names for compatibility
-API_KEY = os.getenv("API_KEY_INTERNAL") or os.getenv("INTERNAL_API_KEY")
-if API_KEY:
-    print(f"[DEPS] Found API key: {API_KEY[:10]}...", flush=True)
-else:
-    print(f"[DEPS] API_KEY_INTERNAL from env: {os.getenv('API_KEY_INTERNAL')}", flush=True)
-    print(f"[DEPS] INTERNAL_API_KEY from env: {os.getenv('INTERNAL_API_KEY')}", flush=True)
-    print(f"[DEPS] All env vars with 'API': {[k for k in os.environ.keys() if 'API' in k.upper()]}", flush=True)
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def _load_api_key() -> Optional[str]:
+    """Load .env once and resolve the internal API key."""
+    load_dotenv(dotenv_path=env_path)
+
+    # Try both variable names for compatibility
+    api_key = os.getenv("API_KEY_INTERNAL") or os.getenv("INTERNAL_API_KEY")
+    logger.debug("Internal API key configured: %s", bool(api_key))
+    return api_key
+
+
+API_KEY = _load_api_key()
 
 
 async def verify_internal(x_api_key: str = Header(None, alias="X-API-Key")):
@@ -27,20 +35,22 @@ async def verify_internal(x_api_key: str = Header(None, alias="X-API-Key")):
     Verify internal API key from X-API-Key header.
     The header name is explicitly set to 'X-API-Key'.
     """
-    print(f"[AUTH] Received header X-API-Key: {x_api_key[:10] if x_api_key else None}...", flush=True)
-    print(f"[AUTH] Expected API_KEY from env: {API_KEY[:10] if API_KEY else None}...", flush=True)
-    print(f"[AUTH] API_KEY is None: {API_KEY is None}", flush=True)
-    
     if not API_KEY:
-        print("[AUTH ERROR] API_KEY_INTERNAL is not set in environment!", flush=True)
         raise HTTPException(status_code=500, detail="API key not configured on server")
-    
+
     if not x_api_key:
-        print("[AUTH ERROR] X-API-Key header is missing", flush=True)
         raise HTTPException(status_code=401, detail="Unauthorized: X-API-Key header required")
-    
-    if x_api_key != API_KEY:
-        print(f"[AUTH ERROR] API key mismatch! Received: {x_api_key[:10]}..., Expected: {API_KEY[:10]}...", flush=True)
+
+    if not secrets.compare_digest(x_api_key.encode(), API_KEY.encode()):
         raise HTTPException(status_code=401, detail="Unauthorized: Invalid API key")
-    
-    print("[AUTH] API key verified successfully", flush=True)
+
+
+async def get_db(request: Request) -> AsyncIOMotorDatabase:
+    """
+    Database handle stored on app.state by the startup hook (None if connecting failed).
+    Kept async so FastAPI calls it inline instead of in the threadpool.
+    """
+    db = request.app.state.db
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database not connected")
+    return db
@@ -1,13 +1,34 @@
+import asyncio
+import logging
 import os
+import queue
 import traceback
+from logging.handlers import QueueHandler, QueueListener
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from app.db import connect, close, db as mongo_db
+from fastapi.responses import JSONResponse, ORJSONResponse
+from app import db as app_db
+from app.db import connect, close, ensure_indexes
 from app.routers import health, reviews, shops, users
+from app.services.gemini_service import get_gemini_service
+from app.services.http_client import close_http_session
+from app.services.yolov8_service import yolov8_service
 
+# 로그는 큐에 넣기만 하고 실제 stderr 쓰기는 리스너 스레드에서 처리 (요청 코루틴에서 I/O 제거)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_stream)
+logging.getLogger().addHandler(QueueHandler(_log_queue))
+logging.getLogger().setLevel(LOG_LEVEL)
 
-app = FastAPI(title="Wheel City API", version="0.1.0")
+
+app = FastAPI(
+    title="Wheel City API",
+    version="0.1.0",
+    default_response_class=ORJSONResponse,
+)
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
@@ -24,23 +45,38 @@ async def global_exception_handler(request: Request, exc: Exception):
         }
     )
 
-origins = os.getenv("CORS_ORIGINS","").split(",") if os.getenv("CORS_ORIGINS") else ["*"]
+origins = [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()] or ["*"]
+# Credentials are only allowed for an explicit origin list; with a wildcard
+# Starlette would otherwise echo back each request's Origin header.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_methods=["*"],
     allow_headers=["*"],
-    allow_credentials=True,
+    allow_credentials=origins != ["*"],
 )
 
 @app.on_event("startup")
 async def on_startup():
+    _log_listener.start()
     await connect()
-    app.state.db = mongo_db
+    # connect() rebinds app.db.db, so read it from the module after connecting
+    app.state.db = app_db.db
+    if app.state.db is not None:
+        await ensure_indexes(app.state.db)
+    # Build the Gemini client up front so the first analysis request doesn't pay for it
+    try:
+        get_gemini_service()
+    except ValueError as e:
+        print(f"⚠️ Gemini service not initialized: {e}")
+    await asyncio.to_thread(yolov8_service.warmup)
 
 @app.on_event("shutdown")
 async def on_shutdown():
+    await close_http_session()
     await close()
+    # Flush whatever is still queued
+    _log_listener.stop()
 
 app.include_router(health.router, prefix="/health", tags=["health"])
 app.include_router(users.router, prefix="/users", tags=["users"])
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import List, Literal, Optional, Sequence
+from functools import lru_cache
+from typing import Callable, List, Literal, Optional, Sequence
 
 from bson import ObjectId
 from pydantic import BaseModel, Field, HttpUrl, validator
@@ -102,27 +103,49 @@ class S3UploadRequest(BaseModel):
     files: List[str] = Field(..., min_length=1)
 
 
-def _stringify(val):
-    """Convert MongoDB types to JSON-serializable types."""
-    if isinstance(val, ObjectId):
-        return str(val)
-    elif isinstance(val, datetime):
-        return val.isoformat()
-    return val
+# Type dispatch table for values that need conversion (keyed on exact type).
+# datetimes are left as-is: FastAPI's encoder emits them as ISO 8601 when
+# rendering the response, same as the isoformat() conversion used to.
+_CONV = {
+    ObjectId: str,
+}
 
 
 def serialize_doc(doc: dict) -> dict:
-    """Convert Mongo ObjectIds and other types to JSON-serializable formats."""
+    """Convert Mongo ObjectIds and other types to JSON-serializable formats.
+
+    The document is converted in place (Motor hands out fresh dicts per
+    document) using an explicit stack instead of recursion.
+    """
     if not isinstance(doc, dict):
         return doc
-    
-    # Create a copy to avoid mutating the original
-    result = {}
-    for key, value in doc.items():
-        if isinstance(value, dict):
-            result[key] = serialize_doc(value)
-        elif isinstance(value, list):
-            result[key] = [serialize_doc(item) if isinstance(item, dict) else _stringify(item) for item in value]
-        else:
-            result[key] = _stringify(value)
-    return result
+
+    stack = [doc]
+    while stack:
+        node = stack.pop()
+        items = node.items() if type(node) is dict else enumerate(node)
+        for key, value in items:
+            t = type(value)
+            conv = _CONV.get(t)
+            if conv is not None:
+                node[key] = conv(value)
+            elif t is dict or t is list:
+                stack.append(value)
+    return doc
+
+
+@lru_cache(maxsize=None)
+def make_serializer(*oid_fields: str) -> Callable[[dict], dict]:
+    """Build a serializer that only converts the given top-level ObjectId fields.
+
+    For collections with a known shape this avoids walking every value the
+    way serialize_doc does.
+    """
+    def serialize(doc: dict) -> dict:
+        for field in oid_fields:
+            value = doc.get(field)
+            if type(value) is ObjectId:
+                doc[field] = str(value)
+        return doc
+
+    return serialize
@@ -1,49 +1,86 @@
+import asyncio
 import logging
 import os
+import time
 import uuid
 from datetime import datetime, timezone
 from typing import List, Optional
 
-import boto3
-import requests
 from bson import ObjectId
-from fastapi import APIRouter, Depends, HTTPException, Query
+from bson.errors import InvalidId
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from pymongo.results import DeleteResult
 
-from app.models import ReviewCreate, S3UploadRequest, serialize_doc
+from app.deps import get_db
+from app.models import ReviewCreate, S3UploadRequest, make_serializer
+from app.services.aggregation import invalidate_scores
+from app.services.accessibility_analysis import analyze_entrance_image
 from app.services.ai_reevaluation import (
     check_user_disagrees_with_ai,
     handle_ai_reevaluation_on_disagree,
 )
+from app.services.http_client import fetch_bytes
+from app.services.s3 import S3_BUCKET_NAME, S3_URL_PREFIX, read_object, s3_client, s3_key_from_url
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
 S3_PRESIGN_EXPIRES = int(os.getenv("S3_PRESIGN_EXPIRES", "900"))
 
+_UTC = timezone.utc
 
-def get_db() -> AsyncIOMotorDatabase:
-    # Import db module to access the current value (not the imported value at module load time)
-    import app.db
-    db = app.db.db
-    if db is None:
-        raise HTTPException(status_code=500, detail="Database not connected")
-    return db
+# Content-Type signed into each upload URL, by file extension
+_CONTENT_TYPE_BY_EXT = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+
+# Review documents only carry ObjectIds in these fields
+_serialize_review = make_serializer("_id", "shop_id", "user_id")
 
 
 def get_s3_client():
     if not S3_BUCKET_NAME:
         raise HTTPException(status_code=500, detail="S3 bucket is not configured")
-    return boto3.client("s3")
+    return s3_client()
+
+
+def _presign_uploads(s3, uploads: List[tuple]) -> List[str]:
+    # Generate pre-signed URLs with Content-Type to match the upload request
+    return [
+        s3.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": S3_BUCKET_NAME,
+                "Key": key,
+                "ContentType": content_type,
+            },
+            ExpiresIn=S3_PRESIGN_EXPIRES,
+        )
+        for key, content_type in uploads
+    ]
 
 
 def _oid(value: str, field: str = "id") -> ObjectId:
-    if not ObjectId.is_valid(value):
+    # Single parse; ObjectId() raises on anything is_valid() would reject
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
         raise HTTPException(status_code=400, detail=f"Invalid {field}")
-    return ObjectId(value)
+
+
+def _review_page(docs: List[dict], limit: int) -> dict:
+    # Keyset pagination: _id is time-ordered, so the last _id is the cursor for the next page
+    next_cursor = str(docs[-1]["_id"]) if len(docs) == limit else None
+    return {
+        "items": [_serialize_review(doc) for doc in docs],
+        "count": len(docs),
+        "next_cursor": next_cursor,
+    }
 
 
 @router.post(
@@ -55,45 +92,98 @@ async def generate_upload_urls(
     request: S3UploadRequest,
     database: AsyncIOMotorDatabase = Depends(get_db),
 ):
-    print(f"[S3] Generating upload URLs for shop {shop_id}, {len(request.files)} files", flush=True)
+    logger.debug("Generating upload URLs for shop %s, %s files", shop_id, len(request.files))
     _ = _oid(shop_id, "shop_id")
     s3 = get_s3_client()
 
-    upload_entries: List[dict] = []
+    # Build every key / Content-Type / public URL up front from per-request prefixes
+    key_prefix = f"reviews/{shop_id}/"
+    url_prefix = S3_URL_PREFIX + key_prefix
+    uploads = []
     public_urls: List[str] = []
-
     for original_name in request.files:
         extension = os.path.splitext(original_name)[1] or ".jpg"
-        key = f"reviews/{shop_id}/{uuid.uuid4().hex}{extension}"
-        print(f"[S3] Generating URL for key: {key}", flush=True)
+        object_name = uuid.uuid4().hex + extension
+        content_type = _CONTENT_TYPE_BY_EXT.get(extension.lower(), "image/jpeg")
+        uploads.append((key_prefix + object_name, content_type))
+        public_urls.append(url_prefix + object_name)
+
+    # SigV4 signing is CPU work in botocore; do the whole batch in one worker thread
+    upload_urls = await asyncio.to_thread(_presign_uploads, s3, uploads)
+    upload_entries: List[dict] = [
+        {"file_name": key, "upload_url": upload_url}
+        for (key, _), upload_url in zip(uploads, upload_urls)
+    ]
+
+    logger.debug("Returning %s upload URLs", len(public_urls))
+    return {"upload_urls": upload_entries, "public_urls": public_urls}
+
+
+async def _run_initial_ai_eval(
+    database: AsyncIOMotorDatabase,
+    shop_oid: ObjectId,
+    photo_urls: list,
+):
+    """Background task: seed a shop's AI prediction from the first review image."""
+    # Use the first image for initial AI evaluation
+    first_image_url = str(photo_urls[0])
+    try:
+        logger.debug("Downloading %s for initial AI evaluation", first_image_url)
+        # Download our own bucket's objects with credentials
+        s3_key = s3_key_from_url(first_image_url)
+        if s3_key is not None:
+            # boto3 is blocking; run the GET + body read in a worker thread
+            image_bytes = await asyncio.to_thread(read_object, s3_key)
+        else:
+            # Fallback to HTTP request for external URLs
+            image_bytes = await fetch_bytes(first_image_url)
+        
+        filename = first_image_url.split("/")[-1] if "/" in first_image_url else "image.jpg"
+        gemini_result = await analyze_entrance_image(image_bytes, filename)
         
-        # Determine content type from extension
-        content_type_map = {
-            ".jpg": "image/jpeg",
-            ".jpeg": "image/jpeg",
-            ".png": "image/png",
-            ".gif": "image/gif",
-            ".webp": "image/webp",
+        # Convert to prediction format
+        # Use only Gemini's direct ramp/curb detection
+        gemini_ramp = gemini_result.get("ramp", False)
+        gemini_curb = gemini_result.get("curb", False)
+        
+        has_ramp = gemini_ramp
+        has_curb = gemini_curb
+        
+        # Update shop with AI prediction (photo URLs were validated by ReviewCreate)
+        update_doc = {
+            "ai_prediction": {"ramp": has_ramp, "curb": has_curb, "image_url": first_image_url},
+            "needPhotos": False,
         }
-        content_type = content_type_map.get(extension.lower(), "image/jpeg")
         
-        # Generate pre-signed URL with Content-Type to match the upload request
-        upload_url = s3.generate_presigned_url(
-            "put_object",
-            Params={
-                "Bucket": S3_BUCKET_NAME,
-                "Key": key,
-                "ContentType": content_type,
-            },
-            ExpiresIn=S3_PRESIGN_EXPIRES,
+        await database.shops.update_one(
+            {"_id": shop_oid},
+            {"$set": update_doc}
         )
-        public_url = f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/{key}"
-        upload_entries.append({"file_name": key, "upload_url": upload_url})
-        public_urls.append(public_url)
-        print(f"[S3] Generated public URL: {public_url} with Content-Type: {content_type}", flush=True)
+        
+        logger.info(
+            "Initial AI evaluation completed for shop %s: ramp=%s, curb=%s", shop_oid, has_ramp, has_curb
+        )
+    except Exception as e:
+        logger.error("Failed initial AI evaluation for shop %s: %s", shop_oid, e, exc_info=True)
+        # Don't fail review submission if initial evaluation fails
 
-    print(f"[S3] Returning {len(public_urls)} upload URLs", flush=True)
-    return {"upload_urls": upload_entries, "public_urls": public_urls}
+
+async def _run_ai_reevaluation(
+    database: AsyncIOMotorDatabase,
+    shop_oid: ObjectId,
+    inserted_review: dict,
+):
+    """Background task: re-evaluate the shop's AI prediction after a disagreeing review."""
+    try:
+        await handle_ai_reevaluation_on_disagree(
+            database, shop_oid, inserted_review
+        )
+    except Exception as e:
+        logger.error(
+            "Error during AI re-evaluation for shop %s: %s", shop_oid, e,
+            exc_info=True,
+        )
+        # The review is already saved; re-evaluation failures are only logged
 
 
 @router.post(
@@ -103,13 +193,14 @@ async def generate_upload_urls(
 async def submit_review(
     shop_id: str,
     payload: ReviewCreate,
+    background: BackgroundTasks,
     database: AsyncIOMotorDatabase = Depends(get_db),
 ):
     shop_oid = _oid(shop_id, "shop_id")
     user_oid = _oid(payload.user_id, "user_id")
 
     # Get shop to check AI prediction
-    shop = await database.shops.find_one({"_id": shop_oid})
+    shop = await database.shops.find_one({"_id": shop_oid}, projection={"ai_prediction": 1})
     if not shop:
         raise HTTPException(status_code=404, detail="Shop not found")
 
@@ -117,30 +208,22 @@ async def submit_review(
     shop_ai_pred = shop.get("ai_prediction")
     user_disagrees = False
     if shop_ai_pred:
-        user_disagrees = await check_user_disagrees_with_ai(
-            payload.ai_correct.model_dump(), shop_ai_pred
-        )
+        user_disagrees = check_user_disagrees_with_ai(payload.ai_correct.model_dump(), shop_ai_pred)
 
     doc = payload.model_dump()
     doc["shop_id"] = shop_oid
     doc["user_id"] = user_oid
-    doc["created_at"] = datetime.now(timezone.utc)
+    doc["created_at"] = datetime.fromtimestamp(time.time(), _UTC)
     doc["disagree_with_ai"] = user_disagrees
     
     # Convert HttpUrl objects to strings for MongoDB
     if "photo_urls" in doc and doc["photo_urls"]:
         doc["photo_urls"] = [str(url) for url in doc["photo_urls"]]
 
-    print(f"[REVIEW] Inserting review document: shop_id={shop_oid}, user_id={user_oid}", flush=True)
-    print(f"[REVIEW] Review document keys: {list(doc.keys())}", flush=True)
-    print(f"[REVIEW] Review text: {doc.get('review_text', 'N/A')[:50]}...", flush=True)
-    print(f"[REVIEW] Photo URLs count: {len(doc.get('photo_urls', []))}", flush=True)
-    
     result = await database.reviews.insert_one(doc)
     inserted_id = result.inserted_id
-    
-    print(f"[REVIEW] Review inserted successfully with ID: {inserted_id}", flush=True)
-    print(f"[REVIEW] Insert result acknowledged: {result.acknowledged}", flush=True)
+    invalidate_scores(shop_oid)
+    logger.debug("Inserted review %s for shop %s", inserted_id, shop_oid)
 
     # Increment user's review_score: 0.2m if photos are included, 0.1m otherwise
     score_increment = 0.2 if payload.photo_urls and len(payload.photo_urls) > 0 else 0.1
@@ -149,132 +232,21 @@ async def submit_review(
             {"_id": user_oid},
             {"$inc": {"review_score": score_increment}}
         )
-        print(f"[REVIEW] Incremented review_score by {score_increment}m for user {payload.user_id} (photos: {len(payload.photo_urls) if payload.photo_urls else 0})", flush=True)
     except Exception as e:
-        print(f"[REVIEW ERROR] Failed to increment review_score: {e}", flush=True)
-        logger.error(f"Failed to increment review_score for user {payload.user_id}: {e}")
+        logger.error("Failed to increment review_score for user %s: %s", user_oid, e)
         # Don't fail review submission if score increment fails
 
     # If review has images and shop doesn't have AI prediction, trigger initial AI evaluation
     if payload.photo_urls and len(payload.photo_urls) > 0:
-        shop_ai_pred = shop.get("ai_prediction")
         if not shop_ai_pred:
-            print(f"[REVIEW] Shop {shop_id} has no AI prediction, triggering initial evaluation with review images", flush=True)
-            logger.info(f"Shop {shop_id} has no AI prediction, triggering initial evaluation with review images")
-            # Use the first image for initial AI evaluation
-            first_image_url = str(payload.photo_urls[0])
-            try:
-                from app.services.gemini_service import get_gemini_service
-                from app.services.yolov8_service import yolov8_service
-                from app.models import ShopUpdateAI
-                
-                print(f"[REVIEW] Downloading image from {first_image_url} for initial AI evaluation", flush=True)
-                # Extract S3 key from URL (format: https://bucket.s3.amazonaws.com/key)
-                # or use the URL directly if it's already a key
-                if first_image_url.startswith(f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/"):
-                    s3_key = first_image_url.replace(f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/", "")
-                    # Download using boto3 with credentials
-                    s3 = get_s3_client()
-                    print(f"[REVIEW] Downloading from S3 bucket {S3_BUCKET_NAME}, key: {s3_key}", flush=True)
-                    s3_response = s3.get_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
-                    image_bytes = s3_response['Body'].read()
-                    print(f"[REVIEW] Successfully downloaded {len(image_bytes)} bytes from S3", flush=True)
-                else:
-                    # Fallback to HTTP request for external URLs
-                    print(f"[REVIEW] Using HTTP request for external URL", flush=True)
-                    image_response = requests.get(first_image_url, timeout=30)
-                    image_response.raise_for_status()
-                    image_bytes = image_response.content
-                
-                # Run YOLOv8 analysis
-                print(f"[REVIEW] Running YOLOv8 analysis for initial evaluation", flush=True)
-                yolov8_features = await yolov8_service.analyze_accessibility_features(image_bytes)
-                
-                # Extract entrance region if detected
-                entrance_image = None
-                if yolov8_features.get("entrance_detected", False):
-                    entrance_image = await yolov8_service.extract_entrance_region(
-                        image_bytes, yolov8_features.get("detections", [])
-                    )
-                
-                # Use entrance region for Gemini if available
-                analysis_image = entrance_image if entrance_image else image_bytes
-                filename = first_image_url.split("/")[-1] if "/" in first_image_url else "image.jpg"
-                
-                # Run Gemini analysis
-                print(f"[REVIEW] Running Gemini analysis for initial evaluation", flush=True)
-                gemini = get_gemini_service()
-                gemini_result = await gemini.analyze_accessibility(analysis_image, filename)
-                
-                # Convert to prediction format
-                # Use only Gemini's direct ramp/curb detection
-                gemini_ramp = gemini_result.get("ramp", False)
-                gemini_curb = gemini_result.get("curb", False)
-                
-                has_ramp = gemini_ramp
-                has_curb = gemini_curb
-                
-                # Update shop with AI prediction
-                ai_prediction = ShopUpdateAI(
-                    ramp=has_ramp,
-                    curb=has_curb,
-                    image_url=payload.photo_urls[0]
-                )
-                
-                # Convert to dict and ensure image_url is a string (not HttpUrl)
-                ai_pred_dict = ai_prediction.model_dump()
-                if "image_url" in ai_pred_dict and ai_pred_dict["image_url"]:
-                    ai_pred_dict["image_url"] = str(ai_pred_dict["image_url"])
-                
-                update_doc = {
-                    "ai_prediction": ai_pred_dict,
-                    "needPhotos": False,
-                }
-                
-                await database.shops.update_one(
-                    {"_id": shop_oid},
-                    {"$set": update_doc}
-                )
-                
-                print(f"[REVIEW] Initial AI evaluation completed: ramp={has_ramp}, curb={has_curb}", flush=True)
-                logger.info(f"Initial AI evaluation completed for shop {shop_id}: ramp={has_ramp}, curb={has_curb}")
-            except Exception as e:
-                print(f"[REVIEW ERROR] Failed initial AI evaluation: {e}", flush=True)
-                import traceback
-                print(f"[REVIEW ERROR] Traceback:\n{traceback.format_exc()}", flush=True)
-                logger.error(f"Failed initial AI evaluation for shop {shop_id}: {e}", exc_info=True)
-                # Don't fail review submission if initial evaluation fails
-
-    # If user disagrees, trigger re-evaluation logic
+            logger.info("Shop %s has no AI prediction, scheduling initial evaluation", shop_id)
+            background.add_task(_run_initial_ai_eval, database, shop_oid, doc["photo_urls"])
+
+    # If user disagrees, trigger re-evaluation logic after the response is sent
     if user_disagrees:
-        print(f"[REVIEW] User disagrees with AI for shop {shop_id}, checking for re-evaluation", flush=True)
-        logger.info(
-            f"User disagrees with AI for shop {shop_id}, checking for re-evaluation"
-        )
-        # Get the inserted review document
-        inserted_review = await database.reviews.find_one({"_id": inserted_id})
-        if inserted_review:
-            print(f"[REVIEW] Calling handle_ai_reevaluation_on_disagree for shop {shop_id}", flush=True)
-            # Run re-evaluation asynchronously (don't block the response)
-            # In production, you might want to use a background task queue
-            try:
-                await handle_ai_reevaluation_on_disagree(
-                    database, shop_oid, inserted_review
-                )
-                print(f"[REVIEW] Re-evaluation completed for shop {shop_id}", flush=True)
-            except Exception as e:
-                print(f"[REVIEW ERROR] Error during AI re-evaluation for shop {shop_id}: {e}", flush=True)
-                import traceback
-                print(f"[REVIEW ERROR] Traceback:\n{traceback.format_exc()}", flush=True)
-                logger.error(
-                    f"Error during AI re-evaluation for shop {shop_id}: {e}",
-                    exc_info=True,
-                )
-                # Don't fail the review submission if re-evaluation fails
-        else:
-            print(f"[REVIEW ERROR] Could not find inserted review with id {inserted_id}", flush=True)
-    else:
-        print(f"[REVIEW] User does NOT disagree with AI for shop {shop_id}", flush=True)
+        logger.info("User disagrees with AI for shop %s, scheduling re-evaluation", shop_id)
+        # insert_one filled in doc["_id"], so doc is the stored review
+        background.add_task(_run_ai_reevaluation, database, shop_oid, doc)
 
     return {"review_id": str(inserted_id), "status": "success"}
 
@@ -286,18 +258,20 @@ async def submit_review(
 async def list_reviews_for_shop(
     shop_id: str,
     limit: int = Query(50, ge=1, le=100),
+    before: Optional[str] = Query(None, description="next_cursor from the previous page"),
     database: AsyncIOMotorDatabase = Depends(get_db),
 ):
     shop_oid = _oid(shop_id, "shop_id")
+    query = {"shop_id": shop_oid}
+    if before:
+        query["_id"] = {"$lt": _oid(before, "before")}
     cursor = (
-        database.reviews.find({"shop_id": shop_oid})
-        .sort("created_at", -1)
+        database.reviews.find(query)
+        .sort("_id", -1)
         .limit(limit)
     )
-    reviews: List[dict] = []
-    async for doc in cursor:
-        reviews.append(serialize_doc(doc))
-    return {"items": reviews, "count": len(reviews)}
+    docs = await cursor.to_list(length=limit)
+    return _review_page(docs, limit)
 
 
 @router.get(
@@ -307,18 +281,20 @@ async def list_reviews_for_shop(
 async def list_reviews_by_user(
     user_id: str,
     limit: int = Query(50, ge=1, le=100),
+    before: Optional[str] = Query(None, description="next_cursor from the previous page"),
     database: AsyncIOMotorDatabase = Depends(get_db),
 ):
     user_oid = _oid(user_id, "user_id")
+    query = {"user_id": user_oid}
+    if before:
+        query["_id"] = {"$lt": _oid(before, "before")}
     cursor = (
-        database.reviews.find({"user_id": user_oid})
-        .sort("created_at", -1)
+        database.reviews.find(query)
+        .sort("_id", -1)
         .limit(limit)
     )
-    reviews: List[dict] = []
-    async for doc in cursor:
-        reviews.append(serialize_doc(doc))
-    return {"items": reviews, "count": len(reviews)}
+    docs = await cursor.to_list(length=limit)
+    return _review_page(docs, limit)
 
 
 @router.delete(
@@ -330,8 +306,12 @@ async def delete_review(
     database: AsyncIOMotorDatabase = Depends(get_db),
 ):
     review_oid = _oid(review_id, "review_id")
-    delete_result: DeleteResult = await database.reviews.delete_one({"_id": review_oid})
-    if delete_result.deleted_count == 0:
+    # find_one_and_delete tells us which shop's cached averages to drop
+    deleted = await database.reviews.find_one_and_delete(
+        {"_id": review_oid}, projection={"shop_id": 1}
+    )
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Review not found")
+    invalidate_scores(deleted.get("shop_id"))
     return {"ok": True}
 
@@ -1,79 +1,94 @@
+import asyncio
 import logging
 import re
 import sys
 from typing import List, Optional
 
-import requests
+import aiohttp
 from bson import ObjectId
+from bson.errors import InvalidId
 from fastapi import APIRouter, Depends, HTTPException, Query
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from pymongo import ReturnDocument
 from pymongo.errors import OperationFailure, ServerSelectionTimeoutError
 
-from app.deps import verify_internal
-from app.models import AIPredictionRequest, AverageScores, ShopCreate, ShopUpdateAI, serialize_doc
-from app.services.gemini_service import get_gemini_service
-from app.services.yolov8_service import yolov8_service
+from app.deps import get_db, verify_internal
+from app.models import AIPredictionRequest, AverageScores, ShopCreate, make_serializer
+from app.services.aggregation import cache_scores, get_cached_scores
+from app.services.accessibility_analysis import analyze_entrance_image
+from app.services.http_client import fetch_bytes
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Shop documents only carry an ObjectId in _id
+_serialize_shop = make_serializer("_id")
 
-def get_db() -> AsyncIOMotorDatabase:
-    print("[GET_DB] get_db() called", flush=True)
-    # Import db module to access the current value (not the imported value at module load time)
-    import app.db
-    db = app.db.db
-    if db is None:
-        print("[GET_DB ERROR] Database is None!", flush=True)
-        raise HTTPException(status_code=500, detail="Database not connected")
-    print("[GET_DB] Returning database", flush=True)
-    return db
+# OperationFailure code for "text index required for $text query"
+_INDEX_NOT_FOUND = 27
 
+# $near returns results by distance; cap the page so one request can't pull the whole collection
+NEARBY_LIMIT = 200
 
-async def _fetch_average_scores(database: AsyncIOMotorDatabase, shop_id: ObjectId) -> AverageScores:
-    pipeline = [
-        {"$match": {"shop_id": shop_id}},
-        {
-            "$group": {
-                "_id": "$shop_id",
-                "enter_success_rate": {"$avg": {"$cond": ["$enter", 1, 0]}},
-                "alone_entry_rate": {"$avg": {"$cond": ["$alone", 1, 0]}},
-                "comfort_rate": {"$avg": {"$cond": ["$comfort", 1, 0]}},
-                "ai_accuracy_rate": {
-                    "$avg": {
-                        "$divide": [
-                            {
-                                "$add": [
-                                    {"$cond": [{"$eq": ["$ai_correct.ramp", True]}, 1, 0]},
-                                    {"$cond": [{"$eq": ["$ai_correct.curb", True]}, 1, 0]},
-                                ]
-                            },
-                            2,
-                        ]
-                    }
+
+# Per-shop review averages, computed inside get_shop's $lookup
+_AVERAGE_SCORES_GROUP = {
+    "_id": None,
+    "enter_success_rate": {"$avg": {"$cond": ["$enter", 1, 0]}},
+    "alone_entry_rate": {"$avg": {"$cond": ["$alone", 1, 0]}},
+    "comfort_rate": {"$avg": {"$cond": ["$comfort", 1, 0]}},
+    "ai_accuracy_rate": {
+        "$avg": {
+            "$divide": [
+                {
+                    "$add": [
+                        {"$cond": [{"$eq": ["$ai_correct.ramp", True]}, 1, 0]},
+                        {"$cond": [{"$eq": ["$ai_correct.curb", True]}, 1, 0]},
+                    ]
                 },
+                2,
+            ]
+        }
+    },
+}
+
+
+def _shop_with_scores_pipeline(shop_id: ObjectId) -> list:
+    """Shop document plus its average_scores in a single aggregation (0.0 when there are no reviews)."""
+    return [
+        {"$match": {"_id": shop_id}},
+        {
+            "$lookup": {
+                "from": "reviews",
+                "let": {"sid": "$_id"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$shop_id", "$$sid"]}}},
+                    # Only the fields the averages read (drops review_text, photo_urls, ...)
+                    {"$project": {"_id": 0, "enter": 1, "alone": 1, "comfort": 1, "ai_correct": 1}},
+                    {"$group": _AVERAGE_SCORES_GROUP},
+                ],
+                "as": "scores",
             }
         },
+        {
+            "$addFields": {
+                "average_scores": {
+                    field: {"$ifNull": [{"$arrayElemAt": [f"$scores.{field}", 0]}, 0.0]}
+                    for field in AverageScores.model_fields
+                }
+            }
+        },
+        {"$project": {"scores": 0}},
     ]
-    cursor = database.reviews.aggregate(pipeline)
-    agg = await cursor.to_list(1)
-    if not agg:
-        return AverageScores()
-    record = agg[0]
-    return AverageScores(
-        enter_success_rate=record.get("enter_success_rate", 0.0) or 0.0,
-        alone_entry_rate=record.get("alone_entry_rate", 0.0) or 0.0,
-        comfort_rate=record.get("comfort_rate", 0.0) or 0.0,
-        ai_accuracy_rate=record.get("ai_accuracy_rate", 0.0) or 0.0,
-    )
 
 
 def _oid(id_str: str) -> ObjectId:
-    if not ObjectId.is_valid(id_str):
+    # Single parse; ObjectId() raises on anything is_valid() would reject
+    try:
+        return ObjectId(id_str)
+    except (InvalidId, TypeError):
         raise HTTPException(status_code=400, detail="Invalid id")
-    return ObjectId(id_str)
 
 
 @router.post("/", dependencies=[Depends(verify_internal)], summary="Create a new shop")
@@ -99,11 +114,10 @@ async def nearby_shops(
             }
         }
     }
-    cursor = database.shops.find(query)
-    results = []
-    async for doc in cursor:
-        results.append(serialize_doc(doc))
-    return results
+    # The default first batch is 101 documents; ask for the whole capped page in one reply
+    cursor = database.shops.find(query).limit(NEARBY_LIMIT).batch_size(NEARBY_LIMIT)
+    docs = await cursor.to_list(length=NEARBY_LIMIT)
+    return [_serialize_shop(doc) for doc in docs]
 
 
 @router.get("/search", summary="Search shops by text")
@@ -112,71 +126,52 @@ async def search_shops(
     limit: int = Query(20, ge=1, le=50),
     database: AsyncIOMotorDatabase = Depends(get_db),
 ):
-    print(f"[SEARCH] FUNCTION CALLED - text: {text}, limit: {limit}", flush=True)
     try:
-        print(f"[SEARCH] Searching shops with text: {text}, limit: {limit}", flush=True)
-        logger.info(f"Searching shops with text: {text}, limit: {limit}")
-        # Escape special regex characters to prevent injection
-        escaped_text = re.escape(text)
-        query = {"name": {"$regex": escaped_text, "$options": "i"}}
-        print(f"[SEARCH] Query: {query}")
-        logger.info(f"Query: {query}")
+        logger.debug("Searching shops with text: %s, limit: %s", text, limit)
+        # Text index on name (app.db.INDEXES) instead of an unanchored regex collection scan
+        query = {"$text": {"$search": text}}
         
-        # Test database connection first
+        cursor = (
+            database.shops.find(query)
+            .sort([("score", {"$meta": "textScore"})])
+            .limit(limit)
+            .batch_size(limit)
+        )
         try:
-            print("[SEARCH] Testing database ping...")
-            await database.command("ping")
-            print("[SEARCH] Database ping successful")
-            logger.info("Database ping successful")
+            docs = await cursor.to_list(length=limit)
         except OperationFailure as e:
-            error_code = e.code
-            if error_code == 13:  # Unauthorized
-                logger.error(f"MongoDB Authorization Error: {e}")
-                raise HTTPException(
-                    status_code=403,
-                    detail=f"MongoDB authorization failed. Check your database user permissions. Error: {str(e)}"
-                )
-            else:
-                logger.error(f"MongoDB Operation Error: {e}")
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"MongoDB operation failed: {str(e)}"
-                )
-        except ServerSelectionTimeoutError as e:
-            logger.error(f"MongoDB Connection Timeout: {e}")
-            raise HTTPException(
-                status_code=503,
-                detail=f"Cannot connect to MongoDB. Check your connection string and network access. Error: {str(e)}"
+            if e.code != _INDEX_NOT_FOUND:
+                raise
+            # Text index missing (ensure_indexes failed); the regex search below still works
+            logger.warning("shops name text index missing, using regex search: %s", e)
+            docs = []
+        # $text ORs the query's words; keep only names that contain the query itself,
+        # as the regex search always did
+        name_pattern = re.compile(re.escape(text), re.IGNORECASE)
+        docs = [doc for doc in docs if name_pattern.search(doc.get("name") or "")]
+        remaining = limit - len(docs)
+        if remaining > 0:
+            # $text only matches whole words; fill the page with the old substring
+            # matches for partial names (e.g. "카페" in "스타카페")
+            fallback = {"name": {"$regex": re.escape(text), "$options": "i"}}
+            if docs:
+                fallback["_id"] = {"$nin": [doc["_id"] for doc in docs]}
+            docs += await (
+                database.shops.find(fallback).limit(remaining).batch_size(remaining).to_list(length=remaining)
             )
-        
-        print("[SEARCH] Executing find query...")
-        cursor = database.shops.find(query).limit(limit)
-        items = []
-        count = 0
-        print("[SEARCH] Iterating through cursor...")
-        async for doc in cursor:
-            count += 1
-            print(f"[SEARCH] Processing document {count}")
-            try:
-                serialized = serialize_doc(doc)
-                items.append(serialized)
-                print(f"[SEARCH] Successfully serialized document {count}")
-            except Exception as e:
-                print(f"[SEARCH ERROR] Error serializing shop document (count={count}): {e}")
-                logger.error(f"Error serializing shop document (count={count}): {e}", exc_info=True)
-                # Skip this document and continue
-                continue
-        print(f"[SEARCH] Found {len(items)} shops")
-        logger.info(f"Found {len(items)} shops")
-        result = {"items": items, "count": len(items)}
-        print(f"[SEARCH] Returning result with {len(items)} items")
-        return result
+        items = [_serialize_shop(doc) for doc in docs]
+        return {"items": items, "count": len(items)}
     except HTTPException:
         # Re-raise HTTP exceptions as-is
         raise
+    except ServerSelectionTimeoutError as e:
+        logger.error(f"MongoDB Connection Timeout: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=f"Cannot connect to MongoDB. Check your connection string and network access. Error: {str(e)}"
+        )
     except OperationFailure as e:
         error_code = e.code
-        print(f"[SEARCH ERROR] MongoDB Operation Failure: {e}, code: {error_code}")
         logger.error(f"MongoDB Operation Failure in search: {e}", exc_info=True)
         if error_code == 13:  # Unauthorized
             raise HTTPException(
@@ -189,25 +184,26 @@ async def search_shops(
                 detail=f"MongoDB operation failed: {str(e)}"
             )
     except Exception as e:
-        print(f"[SEARCH ERROR] Exception in search_shops: {type(e).__name__}: {e}")
-        import traceback
-        traceback_str = traceback.format_exc()
-        print(f"[SEARCH ERROR] Traceback:\n{traceback_str}")
-        logger.error(f"Error in search_shops: {e}", exc_info=True)
-        logger.error(traceback_str)
+        logger.error("Error in search_shops: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
 
 @router.get("/{shop_id}", summary="Get shop details")
 async def get_shop(shop_id: str, database: AsyncIOMotorDatabase = Depends(get_db)):
     oid = _oid(shop_id)
-    shop = await database.shops.find_one({"_id": oid})
-    if not shop:
+    scores = get_cached_scores(oid)
+    if scores is not None:
+        # Averages are fresh enough; skip the reviews $lookup
+        shop = await database.shops.find_one({"_id": oid})
+        if not shop:
+            raise HTTPException(status_code=404, detail="Shop not found")
+        shop["average_scores"] = scores
+        return _serialize_shop(shop)
+    docs = await database.shops.aggregate(_shop_with_scores_pipeline(oid)).to_list(1)
+    if not docs:
         raise HTTPException(status_code=404, detail="Shop not found")
-    scores = await _fetch_average_scores(database, oid)
-    response = serialize_doc(shop)
-    response["average_scores"] = scores.model_dump() if hasattr(scores, "model_dump") else scores.dict()
-    return response
+    cache_scores(oid, docs[0]["average_scores"])
+    return _serialize_shop(docs[0])
 
 
 @router.post(
@@ -226,9 +222,8 @@ async def analyze_and_update_ai_prediction(
     """
     oid = _oid(shop_id)
     
-    # Verify shop exists
-    shop = await database.shops.find_one({"_id": oid})
-    if not shop:
+    # Verify shop exists before paying for the download and model calls
+    if not await database.shops.find_one({"_id": oid}, {"_id": 1}):
         raise HTTPException(status_code=404, detail="Shop not found")
     
     try:
@@ -236,33 +231,13 @@ async def analyze_and_update_ai_prediction(
         image_url = str(payload.image_url)
         print(f"[AI-PRED] Downloading image from {image_url}", flush=True)
         logger.info(f"Downloading image from {image_url}")
-        response = requests.get(image_url, timeout=30)
-        response.raise_for_status()
-        image_bytes = response.content
+        image_bytes = await fetch_bytes(image_url)
         print(f"[AI-PRED] Downloaded {len(image_bytes)} bytes", flush=True)
         
-        # Run YOLOv8 analysis
-        print(f"[AI-PRED] Running YOLOv8 analysis...", flush=True)
-        logger.info("Running YOLOv8 analysis...")
-        yolov8_features = await yolov8_service.analyze_accessibility_features(image_bytes)
-        print(f"[AI-PRED] YOLOv8 results: {yolov8_features}", flush=True)
-        
-        # Extract entrance region if detected for better Gemini analysis
-        entrance_image = None
-        if yolov8_features.get("entrance_detected", False):
-            entrance_image = await yolov8_service.extract_entrance_region(
-                image_bytes, yolov8_features.get("detections", [])
-            )
-        
-        # Use entrance region for Gemini analysis if available, otherwise use full image
-        analysis_image = entrance_image if entrance_image else image_bytes
         filename = image_url.split("/")[-1] if "/" in image_url else "image.jpg"
         
-        # Run Gemini analysis
-        print(f"[AI-PRED] Running Gemini analysis...", flush=True)
-        logger.info("Running Gemini analysis...")
-        gemini = get_gemini_service()
-        gemini_result = await gemini.analyze_accessibility(analysis_image, filename)
+        logger.info("Running YOLOv8 + Gemini analysis...")
+        gemini_result = await analyze_entrance_image(image_bytes, filename)
         print(f"[AI-PRED] Gemini results: {gemini_result}", flush=True)
         
         # Convert analysis results to AIPrediction format
@@ -274,16 +249,9 @@ async def analyze_and_update_ai_prediction(
         has_curb = gemini_curb
         print(f"[AI-PRED] Final prediction: ramp={has_ramp}, curb={has_curb}", flush=True)
         
-        # Create AI prediction
-        ai_prediction = ShopUpdateAI(
-            ramp=has_ramp,
-            curb=has_curb,
-            image_url=payload.image_url
-        )
-        
-        # Update shop with AI prediction
+        # Server-produced values; no need to re-validate through ShopUpdateAI
         update_doc = {
-            "ai_prediction": ai_prediction.model_dump(),
+            "ai_prediction": {"ramp": has_ramp, "curb": has_curb, "image_url": image_url},
             "needPhotos": False,  # Reset needPhotos when AI prediction is updated
         }
         res = await database.shops.find_one_and_update(
@@ -291,11 +259,16 @@ async def analyze_and_update_ai_prediction(
             {"$set": update_doc},
             return_document=ReturnDocument.AFTER,
         )
+        # Shop deleted while the analysis was running
+        if res is None:
+            raise HTTPException(status_code=404, detail="Shop not found")
         
         logger.info(f"AI prediction updated for shop {shop_id}: ramp={has_ramp}, curb={has_curb}")
-        return serialize_doc(res)
+        return _serialize_shop(res)
         
-    except requests.RequestException as e:
+    except HTTPException:
+        raise
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         logger.error(f"Failed to download image: {e}")
         raise HTTPException(status_code=400, detail=f"Failed to download image from URL: {str(e)}")
     except Exception as e:
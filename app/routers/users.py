@@ -1,21 +1,19 @@
 from typing import Optional
 
+from bson import ObjectId
 from fastapi import APIRouter, Depends, Header, HTTPException
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
+from app import db as app_db
+from app.deps import get_db
 from app.models import UserCreate, UserUpdate, UserGetOrCreate, serialize_doc
 
 router = APIRouter()
 
-
-def get_db() -> AsyncIOMotorDatabase:
-    # Import db module to access the current value (not the imported value at module load time)
-    import app.db
-    db = app.db.db
-    if db is None:
-        raise HTTPException(status_code=500, detail="Database not connected")
-    return db
+# Profile fields returned to clients (anything else stored on the user stays server-side)
+_USER_PROJECTION = {field: 1 for field in UserCreate.model_fields}
 
 
 def _auth_header(x_auth_id: Optional[str]) -> str:
@@ -26,11 +24,16 @@ def _auth_header(x_auth_id: Optional[str]) -> str:
 
 @router.post("/", summary="Create a new user")
 async def create_user(user: UserCreate, database: AsyncIOMotorDatabase = Depends(get_db)):
-    existing = await database.users.find_one({"auth_id": user.auth_id})
-    if existing:
-        raise HTTPException(status_code=409, detail="User already exists")
+    if not app_db.unique_indexes_ready:
+        # Unique auth_id index not confirmed at startup (e.g. existing duplicates); check explicitly
+        if await database.users.find_one({"auth_id": user.auth_id}, {"_id": 1}):
+            raise HTTPException(status_code=409, detail="User already exists")
     doc = user.model_dump()
-    res = await database.users.insert_one(doc)
+    # The unique auth_id index rejects duplicates (no find_one first, no race)
+    try:
+        res = await database.users.insert_one(doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="User already exists")
     doc["_id"] = str(res.inserted_id)
     return doc
 
@@ -41,7 +44,7 @@ async def get_current_user(
     database: AsyncIOMotorDatabase = Depends(get_db),
 ):
     auth_id = _auth_header(x_auth_id)
-    user = await database.users.find_one({"auth_id": auth_id})
+    user = await database.users.find_one({"auth_id": auth_id}, projection=_USER_PROJECTION)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return serialize_doc(user)
@@ -60,6 +63,7 @@ async def update_current_user(
     res = await database.users.find_one_and_update(
         {"auth_id": auth_id},
         {"$set": update_data},
+        projection=_USER_PROJECTION,
         return_document=ReturnDocument.AFTER,
     )
     if not res:
@@ -76,21 +80,11 @@ async def get_or_create_user_by_kakao(
     Get existing user by Kakao ID, or create a new one if not found.
     Returns the user_id and whether the user was created.
     """
-    # Try to find existing user by kakao_id
-    existing_user = await database.users.find_one({"kakao_id": payload.kakao_id})
-    
-    if existing_user:
-        return {
-            "user_id": str(existing_user["_id"]),
-            "created": False,
-            "user": serialize_doc(existing_user)
-        }
-    
-    # User doesn't exist, create a new one
-    # Use kakao_id as auth_id for Kakao users
+    # Use kakao_id as auth_id for Kakao users; kakao_id itself comes from the upsert filter
+    new_id = ObjectId()
     new_user_data = {
+        "_id": new_id,
         "auth_id": f"kakao_{payload.kakao_id}",
-        "kakao_id": payload.kakao_id,
         "email": payload.email,
         "name": payload.name or "카카오사용자",
         "wheelchair_type": "manual",  # Default values
@@ -98,12 +92,26 @@ async def get_or_create_user_by_kakao(
         "review_score": 0.0,
     }
     
-    result = await database.users.insert_one(new_user_data)
-    new_user_data["_id"] = result.inserted_id
+    # Single round trip: returns the existing user, or inserts new_user_data.
+    # The unique kakao_id index makes concurrent first logins collapse to one user.
+    try:
+        user = await database.users.find_one_and_update(
+            {"kakao_id": payload.kakao_id},
+            {"$setOnInsert": new_user_data},
+            upsert=True,
+            projection=_USER_PROJECTION,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # A concurrent request inserted the same user first
+        user = await database.users.find_one(
+            {"kakao_id": payload.kakao_id}, projection=_USER_PROJECTION
+        )
+        if user is None:
+            raise HTTPException(status_code=409, detail="User already exists")
     
     return {
-        "user_id": str(result.inserted_id),
-        "created": True,
-        "user": serialize_doc(new_user_data)
+        "user_id": str(user["_id"]),
+        "created": user["_id"] == new_id,
+        "user": serialize_doc(user)
     }
-
@@ -0,0 +1,53 @@
+"""
+YOLOv8 + Gemini accessibility analysis of one entrance photo.
+"""
+import asyncio
+from typing import Any, Dict, Optional
+
+from app.services.gemini_service import get_gemini_service
+from app.services.yolov8_service import yolov8_service
+
+
+async def _entrance_crop(image_bytes: bytes, yolov8_features: Dict[str, Any]) -> Optional[bytes]:
+    # Extract entrance region if detected for better Gemini analysis
+    if not yolov8_features.get("entrance_detected", False):
+        return None
+    return await yolov8_service.extract_entrance_region(
+        image_bytes, yolov8_features.get("detections", [])
+    )
+
+
+async def analyze_with_features(
+    image_bytes: bytes, filename: str, yolov8_features: Dict[str, Any], use_cache: bool = True
+) -> Dict[str, Any]:
+    """
+    Gemini on the entrance region when YOLOv8 found one, otherwise on the full image.
+    yolov8_features is the result of analyze_accessibility_features for image_bytes.
+    use_cache=False skips Gemini's result cache (see GeminiService.analyze_accessibility).
+    """
+    entrance_image = await _entrance_crop(image_bytes, yolov8_features)
+    return await get_gemini_service().analyze_accessibility(
+        entrance_image or image_bytes, filename, use_cache=use_cache
+    )
+
+
+async def analyze_entrance_image(image_bytes: bytes, filename: str) -> Dict[str, Any]:
+    """
+    Run YOLOv8 to find the entrance, then Gemini on the cropped entrance
+    (or on the full image when there is none). Returns Gemini's result.
+    """
+    gemini = get_gemini_service()
+    # Speculatively run Gemini on the full image while YOLOv8 looks for an entrance
+    full_task = asyncio.create_task(gemini.analyze_accessibility(image_bytes, filename))
+    try:
+        yolov8_features = await yolov8_service.analyze_accessibility_features(image_bytes)
+        entrance_image = await _entrance_crop(image_bytes, yolov8_features)
+        if entrance_image:
+            full_task.cancel()
+            return await gemini.analyze_accessibility(entrance_image, filename)
+        return await full_task
+    finally:
+        full_task.cancel()
+        if full_task.done() and not full_task.cancelled():
+            # Retrieve a discarded failure so asyncio doesn't report it as never retrieved
+            full_task.exception()
@@ -0,0 +1,43 @@
+"""
+Short-lived in-process cache of per-shop average review scores.
+
+Entries expire after SCORES_CACHE_TTL seconds and are dropped explicitly when
+a review for the shop is added or deleted. With several workers, another
+worker's copy can be stale for at most the TTL.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from bson import ObjectId
+
+SCORES_CACHE_TTL = float(os.getenv("SCORES_CACHE_TTL", "60"))
+SCORES_CACHE_SIZE = int(os.getenv("SCORES_CACHE_SIZE", "10000"))
+
+# shop_id -> (expires_at, average_scores), oldest insertion first
+_scores_cache: "OrderedDict[ObjectId, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+
+def get_cached_scores(shop_id: ObjectId) -> Optional[Dict[str, Any]]:
+    entry = _scores_cache.get(shop_id)
+    if entry is None:
+        return None
+    expires_at, scores = entry
+    if expires_at < time.monotonic():
+        _scores_cache.pop(shop_id, None)
+        return None
+    return dict(scores)
+
+
+def cache_scores(shop_id: ObjectId, scores: Dict[str, Any]) -> None:
+    if SCORES_CACHE_TTL <= 0 or SCORES_CACHE_SIZE <= 0:
+        return
+    _scores_cache.pop(shop_id, None)
+    _scores_cache[shop_id] = (time.monotonic() + SCORES_CACHE_TTL, dict(scores))
+    if len(_scores_cache) > SCORES_CACHE_SIZE:
+        _scores_cache.popitem(last=False)
+
+
+def invalidate_scores(shop_id: ObjectId) -> None:
+    _scores_cache.pop(shop_id, None)
@@ -1,21 +1,34 @@
 """
 Service for handling AI re-evaluation when users disagree with AI predictions.
 """
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from typing import List, Optional, Dict, Any
 
-import requests
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
-from app.services.gemini_service import get_gemini_service
+from app.services.accessibility_analysis import analyze_with_features
+from app.services.http_client import fetch_bytes
+from app.services.s3 import read_object, s3_key_from_url
 from app.services.yolov8_service import yolov8_service
 
 logger = logging.getLogger(__name__)
 
+# Review fields the re-evaluation logic reads (skips review_text etc.)
+_REEVAL_REVIEW_FIELDS = {"_id": 1, "ai_correct": 1, "disagree_with_ai": 1, "photo_urls": 1, "created_at": 1}
 
-async def check_user_disagrees_with_ai(
+# Blocking S3 downloads run here so several images transfer at once
+# without tying up the event loop (or the default to_thread pool)
+_DOWNLOAD_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="reeval-download")
+
+# Upper bound on concurrent Gemini image analyses across all re-evaluations
+_ANALYSIS_SLOTS = asyncio.Semaphore(8)
+
+
+def check_user_disagrees_with_ai(
     review_ai_correct: Dict[str, bool], shop_ai_prediction: Optional[Dict[str, Any]]
 ) -> bool:
     """
@@ -40,16 +53,14 @@ async def check_user_disagrees_with_ai(
 async def get_last_n_reviews(
     database: AsyncIOMotorDatabase, shop_id: ObjectId, n: int = 3
 ) -> List[Dict[str, Any]]:
-    """Get the last N reviews for a shop, ordered by created_at descending."""
+    """Get the last N reviews for a shop, newest first."""
+    # _id is time-ordered and shares the (shop_id, _id) index with the review list
     cursor = (
-        database.reviews.find({"shop_id": shop_id})
-        .sort("created_at", -1)
+        database.reviews.find({"shop_id": shop_id}, projection=_REEVAL_REVIEW_FIELDS)
+        .sort("_id", -1)
         .limit(n)
     )
-    reviews = []
-    async for doc in cursor:
-        reviews.append(doc)
-    return reviews
+    return await cursor.to_list(length=n)
 
 
 async def all_reviews_disagree(reviews: List[Dict[str, Any]]) -> bool:
@@ -77,59 +88,48 @@ async def collect_image_urls_from_reviews(reviews: List[Dict[str, Any]]) -> List
     return image_urls
 
 
-async def analyze_image_for_ai_prediction(image_url: str) -> Optional[Dict[str, bool]]:
+async def _download_image(image_url: str) -> bytes:
+    """Fetch review image bytes from S3 (with credentials) or over HTTP."""
+    logger.info(f"Downloading image from {image_url} for re-evaluation")
+    
+    # Use boto3 (blocking -> download pool) for S3 URLs, the shared aiohttp session otherwise
+    s3_key = s3_key_from_url(image_url)
+    if s3_key is not None:
+        logger.info(f"Downloading from S3 key: {s3_key}")
+        return await asyncio.get_running_loop().run_in_executor(_DOWNLOAD_POOL, read_object, s3_key)
+    
+    # Fallback to HTTP request for external URLs
+    return await fetch_bytes(image_url)
+
+
+async def _download_many(image_urls: List[str]) -> List[Any]:
+    """Download all images in parallel; failed downloads come back as exceptions."""
+    return await asyncio.gather(
+        *(_download_image(image_url) for image_url in image_urls),
+        return_exceptions=True,
+    )
+
+
+async def _predict_from_features(
+    image_url: str,
+    image_bytes: bytes,
+    yolov8_features: Dict[str, Any],
+) -> Optional[Dict[str, bool]]:
     """
-    Analyze a single image and return AI prediction (ramp, curb).
+    Finish one image's analysis once YOLOv8 features are known.
     Returns None if analysis fails.
     """
+    filename = image_url.split("/")[-1] if "/" in image_url else "image.jpg"
     try:
-        # Download image
-        logger.info(f"Downloading image from {image_url} for re-evaluation")
-        import os
-        import boto3
-        
-        S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
-        
-        # Use boto3 for S3 URLs, requests for external URLs
-        if S3_BUCKET_NAME and image_url.startswith(f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/"):
-            s3_key = image_url.replace(f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/", "")
-            s3 = boto3.client("s3")
-            logger.info(f"Downloading from S3 bucket {S3_BUCKET_NAME}, key: {s3_key}")
-            s3_response = s3.get_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
-            image_bytes = s3_response['Body'].read()
-        else:
-            # Fallback to HTTP request for external URLs
-            response = requests.get(image_url, timeout=30)
-            response.raise_for_status()
-            image_bytes = response.content
-        
-        # Run YOLOv8 analysis
-        yolov8_features = await yolov8_service.analyze_accessibility_features(image_bytes)
-        
-        # Extract entrance region if detected
-        entrance_image = None
-        if yolov8_features.get("entrance_detected", False):
-            entrance_image = await yolov8_service.extract_entrance_region(
-                image_bytes, yolov8_features.get("detections", [])
+        async with _ANALYSIS_SLOTS:
+            # Users disputed the cached verdict for these photos; ask the model again
+            gemini_result = await analyze_with_features(
+                image_bytes, filename, yolov8_features, use_cache=False
             )
         
-        # Use entrance region for Gemini if available
-        analysis_image = entrance_image if entrance_image else image_bytes
-        filename = image_url.split("/")[-1] if "/" in image_url else "image.jpg"
-        
-        # Run Gemini analysis
-        gemini = get_gemini_service()
-        gemini_result = await gemini.analyze_accessibility(analysis_image, filename)
-        
         # Convert to prediction format
         # Use only Gemini's direct ramp/curb detection
-        gemini_ramp = gemini_result.get("ramp", False)
-        gemini_curb = gemini_result.get("curb", False)
-        
-        has_ramp = gemini_ramp
-        has_curb = gemini_curb
-        
-        return {"ramp": has_ramp, "curb": has_curb}
+        return {"ramp": gemini_result.get("ramp", False), "curb": gemini_result.get("curb", False)}
         
     except Exception as e:
         logger.error(f"Failed to analyze image {image_url}: {e}")
@@ -140,28 +140,51 @@ async def re_evaluate_shop_ai_prediction(
     database: AsyncIOMotorDatabase,
     shop_id: ObjectId,
     review_image_urls: List[str],
-) -> Optional[Dict[str, bool]]:
+) -> Optional[Dict[str, Any]]:
     """
     Re-run AI analysis on review images.
-    Returns AI prediction if at least one image analysis succeeds, None otherwise.
+    Returns the AI prediction (ramp, curb and the image_url it came from) of the
+    first image, in review order, whose analysis succeeds; None if none do.
     """
     if not review_image_urls:
         return None
     
-    successful_predictions = []
+    # Download every image up front
+    downloads = await _download_many(review_image_urls)
+    images = []
+    for image_url, result in zip(review_image_urls, downloads):
+        if isinstance(result, BaseException):
+            logger.error(f"Failed to download image {image_url}: {result}")
+        else:
+            images.append((image_url, result))
+    if not images:
+        return None
     
-    for image_url in review_image_urls:
-        prediction = await analyze_image_for_ai_prediction(image_url)
-        if prediction:
-            successful_predictions.append(prediction)
+    # One batched YOLOv8 pass over all images
+    try:
+        features = await yolov8_service.analyze_accessibility_features_batch(
+            [data for _, data in images]
+        )
+    except Exception as e:
+        # No entrance crops; every image is analyzed in full
+        logger.error(f"YOLOv8 batch analysis failed for shop {shop_id}: {e}")
+        features = [{} for _ in images]
     
-    if not successful_predictions:
-        return None
+    # One Gemini call per image (entrance crop, or the full image when there is none),
+    # run concurrently
+    predictions = await asyncio.gather(
+        *(
+            _predict_from_features(image_url, data, image_features)
+            for (image_url, data), image_features in zip(images, features)
+        )
+    )
     
-    # If AI agrees with users on at least one image, use that prediction
     # For now, we'll use the first successful prediction
     # You could also implement voting logic here
-    return successful_predictions[0]
+    for (image_url, _), prediction in zip(images, predictions):
+        if prediction:
+            return {**prediction, "image_url": image_url}
+    return None
 
 
 async def handle_ai_reevaluation_on_disagree(
@@ -180,8 +203,11 @@ async def handle_ai_reevaluation_on_disagree(
     """
     try:
         print(f"[REEVAL] Starting re-evaluation for shop {shop_id}", flush=True)
-        # Get last 3 reviews
-        last_3_reviews = await get_last_n_reviews(database, shop_id, n=3)
+        # Get the shop and the last 3 reviews together (one round trip of latency)
+        shop, last_3_reviews = await asyncio.gather(
+            database.shops.find_one({"_id": shop_id}, projection={"ai_prediction": 1}),
+            get_last_n_reviews(database, shop_id, n=3),
+        )
         print(f"[REEVAL] Found {len(last_3_reviews)} reviews for shop {shop_id}", flush=True)
         
         if len(last_3_reviews) < 3:
@@ -189,10 +215,6 @@ async def handle_ai_reevaluation_on_disagree(
             logger.info(f"Less than 3 reviews for shop {shop_id}, skipping re-evaluation")
             return
         
-        # Check if all 3 reviews have disagree_with_ai flag
-        # We need to mark the new review as disagreeing first
-        # For now, we'll check if the new review's ai_correct doesn't match shop's ai_prediction
-        shop = await database.shops.find_one({"_id": shop_id})
         if not shop:
             logger.warning(f"Shop {shop_id} not found")
             return
@@ -203,7 +225,7 @@ async def handle_ai_reevaluation_on_disagree(
             return
         
         # Check if new review disagrees
-        new_review_disagrees = await check_user_disagrees_with_ai(
+        new_review_disagrees = check_user_disagrees_with_ai(
             new_review.get("ai_correct", {}), shop_ai_pred
         )
         
@@ -211,14 +233,13 @@ async def handle_ai_reevaluation_on_disagree(
             logger.info(f"New review for shop {shop_id} does not disagree with AI")
             return
         
-        # Mark new review as disagreeing (for future checks)
-        await database.reviews.update_one(
-            {"_id": new_review.get("_id")},
-            {"$set": {"disagree_with_ai": True}}
-        )
-        
-        # Check last 3 reviews again (now with updated flag)
-        last_3_reviews = await get_last_n_reviews(database, shop_id, n=3)
+        # Mark new review as disagreeing (for future checks); the flag is applied to
+        # the already-fetched reviews in memory instead of querying them again
+        new_review_id = new_review.get("_id")
+        flag_ids = [new_review_id]
+        for review in last_3_reviews:
+            if review.get("_id") == new_review_id:
+                review["disagree_with_ai"] = True
         
         # Check if all 3 disagree
         # For older reviews without the flag, check the logic
@@ -232,17 +253,20 @@ async def handle_ai_reevaluation_on_disagree(
             else:
                 # Older review without flag - check logic
                 review_ai_correct = review.get("ai_correct", {})
-                review_disagrees = await check_user_disagrees_with_ai(
+                review_disagrees = check_user_disagrees_with_ai(
                     review_ai_correct, shop_ai_pred
                 )
                 if not review_disagrees:
                     all_disagree = False
                     break
                 # Update the flag for future checks
-                await database.reviews.update_one(
-                    {"_id": review.get("_id")},
-                    {"$set": {"disagree_with_ai": True}}
-                )
+                flag_ids.append(review.get("_id"))
+        
+        # One write for every flag set above
+        await database.reviews.update_many(
+            {"_id": {"$in": flag_ids}},
+            {"$set": {"disagree_with_ai": True}}
+        )
         
         if not all_disagree:
             print(f"[REEVAL] Not all 3 reviews disagree for shop {shop_id}", flush=True)
@@ -278,18 +302,12 @@ async def handle_ai_reevaluation_on_disagree(
         if new_ai_prediction:
             # AI agreed with users on at least one image
             # Update shop's ai_prediction
-            from app.models import ShopUpdateAI
-            
-            # Get the first image URL for the prediction (ensure it's a string)
-            first_image_url = image_urls[0] if image_urls else None
-            if first_image_url:
-                first_image_url = str(first_image_url)
-            
+            # Store the image the prediction was made from
             update_doc = {
                 "ai_prediction": {
                     "ramp": new_ai_prediction["ramp"],
                     "curb": new_ai_prediction["curb"],
-                    "image_url": first_image_url,
+                    "image_url": new_ai_prediction["image_url"],
                 },
                 "needPhotos": False,
                 "ai_recheck_date": datetime.now(timezone.utc),
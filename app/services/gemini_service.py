@@ -1,11 +1,17 @@
+import asyncio
 import os
+import hashlib
+import io
 import json
 import re
+import threading
 import time
+from collections import OrderedDict
 from typing import Optional, Dict, Any
 from dotenv import load_dotenv
 import google.generativeai as genai
 from fastapi import HTTPException
+from PIL import Image, ImageOps
 import logging
 
 load_dotenv()
@@ -16,6 +22,12 @@ class GeminiService:
         self.api_key = os.getenv("GOOGLE_API_KEY")
         self.model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
         self.timeout = float(os.getenv("GEMINI_TIMEOUT", "60.0"))
+        # Longest image edge sent to Gemini; larger photos are downscaled first (0 disables)
+        self.max_image_edge = int(os.getenv("GEMINI_MAX_IMAGE_EDGE", "1024"))
+        
+        # In-process LRU of analysis results keyed by image content hash
+        self.cache_size = int(os.getenv("GEMINI_CACHE_SIZE", "256"))
+        self._result_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
         
         if not self.api_key:
             raise ValueError("GOOGLE_API_KEY environment variable is required")
@@ -63,6 +75,31 @@ class GeminiService:
         ext = os.path.splitext(filename)[1].lower()
         return self.mime_by_ext.get(ext)
     
+    def _downscale_image(self, image_bytes: bytes, mime_type: str) -> tuple[bytes, str]:
+        """Shrink images larger than max_image_edge (Lanczos) and re-encode as JPEG"""
+        if self.max_image_edge <= 0:
+            return image_bytes, mime_type
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as image:
+                if max(image.size) <= self.max_image_edge:
+                    return image_bytes, mime_type
+                # Bake in EXIF orientation; the re-encoded JPEG carries no EXIF
+                image = ImageOps.exif_transpose(image)
+                if image.mode in ("RGBA", "LA", "P"):
+                    # Flatten transparency onto white instead of convert("RGB")'s black
+                    rgba = image.convert("RGBA")
+                    image = Image.new("RGB", rgba.size, (255, 255, 255))
+                    image.paste(rgba, mask=rgba.getchannel("A"))
+                else:
+                    image = image.convert("RGB")
+                image.thumbnail((self.max_image_edge, self.max_image_edge), Image.Resampling.LANCZOS)
+                buf = io.BytesIO()
+                image.save(buf, format="JPEG", quality=90)
+                return buf.getvalue(), "image/jpeg"
+        except Exception as e:
+            logger.warning(f"Could not downscale image, sending original: {e}")
+            return image_bytes, mime_type
+    
     def _extract_json_from_response(self, text: str) -> Optional[str]:
         """Extract JSON from model response using regex patterns"""
         if not text:
@@ -139,9 +176,12 @@ class GeminiService:
             "reason": reason
         }
     
-    async def analyze_accessibility(self, image_bytes: bytes, filename: str) -> Dict[str, Any]:
+    async def analyze_accessibility(
+        self, image_bytes: bytes, filename: str, use_cache: bool = True
+    ) -> Dict[str, Any]:
         """
         Analyze image for accessibility using Gemini API
+        use_cache=False always calls the model (the fresh result still replaces the cached one)
         """
         start_time = time.time()
         
@@ -154,9 +194,23 @@ class GeminiService:
                     detail=f"Unsupported file type: {os.path.splitext(filename)[1]}"
                 )
             
+            # Identical bytes (e.g. the same review photo re-evaluated) reuse the earlier result
+            cache_key = hashlib.sha256(image_bytes).hexdigest()
+            cached = self._result_cache.get(cache_key) if use_cache else None
+            if cached is not None:
+                self._result_cache.move_to_end(cache_key)
+                return dict(cached)
+            
+            # Smaller payload to upload and for the model to tokenize
+            # (PIL decode/resize is CPU work, so keep it off the event loop)
+            payload_bytes, payload_mime = await asyncio.to_thread(
+                self._downscale_image, image_bytes, mime_type
+            )
+            
             # Generate content with image
-            response = self.model.generate_content(
-                [{"inline_data": {"mime_type": mime_type, "data": image_bytes}}],
+            # Async (grpc_asyncio) client: one persistent channel, no blocked event loop
+            response = await self.model.generate_content_async(
+                [{"inline_data": {"mime_type": payload_mime, "data": payload_bytes}}],
                 request_options={"timeout": self.timeout},
             )
             
@@ -175,7 +229,7 @@ class GeminiService:
             
             processing_time = time.time() - start_time
             
-            return {
+            analysis = {
                 "ramp": result["ramp"],
                 "curb": result["curb"],
                 "reason": result["reason"],
@@ -184,6 +238,12 @@ class GeminiService:
                 "processing_time": processing_time,
                 "analyzed_at": time.time()
             }
+            if self.cache_size > 0 and not result["reason"].startswith("Parse error"):
+                self._result_cache.pop(cache_key, None)
+                self._result_cache[cache_key] = analysis
+                if len(self._result_cache) > self.cache_size:
+                    self._result_cache.popitem(last=False)
+            return dict(analysis)
             
         except Exception as e:
             logger.error(f"Gemini analysis error: {e}")
@@ -194,10 +254,14 @@ class GeminiService:
 
 # Provider (singleton) for dependency injection
 _gemini_service_instance = None
+_gemini_service_lock = threading.Lock()
 
 def get_gemini_service() -> "GeminiService":
     global _gemini_service_instance
     if _gemini_service_instance is None:
-        _gemini_service_instance = GeminiService()
+        # Callers may be on worker threads; build the client only once
+        with _gemini_service_lock:
+            if _gemini_service_instance is None:
+                _gemini_service_instance = GeminiService()
     return _gemini_service_instance
 
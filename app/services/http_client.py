@@ -0,0 +1,41 @@
+"""
+Shared aiohttp session for outbound HTTP requests (image downloads).
+"""
+from typing import Optional
+
+import aiohttp
+
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=30)
+
+# Provider (singleton); created lazily inside the running event loop
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            # Most downloads hit the same S3/CDN host; keep a warm pool of connections to it
+            connector=aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=20,
+                keepalive_timeout=30,
+                ttl_dns_cache=300,
+            ),
+            timeout=HTTP_TIMEOUT,
+        )
+    return _session
+
+
+async def fetch_bytes(url: str) -> bytes:
+    """GET a URL and return the response body, raising on HTTP errors."""
+    async with get_http_session().get(url) as response:
+        response.raise_for_status()
+        return await response.read()
+
+
+async def close_http_session() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
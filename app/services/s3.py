@@ -0,0 +1,35 @@
+"""
+Shared boto3 S3 client and helpers for review photos in S3_BUCKET_NAME.
+"""
+import os
+from functools import lru_cache
+from typing import Optional
+
+import boto3
+from botocore.config import Config
+
+S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+# Public URL of an object is S3_URL_PREFIX + key (format: https://bucket.s3.amazonaws.com/key)
+S3_URL_PREFIX = f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/" if S3_BUCKET_NAME else None
+
+
+@lru_cache(maxsize=1)
+def s3_client():
+    # Built on first use (credential/endpoint resolution is slow); boto3 clients are thread-safe.
+    # One connection pool for presigning and for parallel re-evaluation downloads
+    return boto3.client(
+        "s3",
+        config=Config(max_pool_connections=32, retries={"max_attempts": 3, "mode": "adaptive"}),
+    )
+
+
+def s3_key_from_url(url: str) -> Optional[str]:
+    """Object key for a URL in our bucket, or None for any other URL."""
+    if S3_URL_PREFIX and url.startswith(S3_URL_PREFIX):
+        return url[len(S3_URL_PREFIX):]
+    return None
+
+
+def read_object(key: str) -> bytes:
+    """GET an object body with credentials. Blocking; run it in a worker thread."""
+    return s3_client().get_object(Bucket=S3_BUCKET_NAME, Key=key)["Body"].read()
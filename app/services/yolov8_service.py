@@ -1,6 +1,7 @@
+import asyncio
 import os
 import io
-import tempfile
+import threading
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 from PIL import Image
@@ -93,7 +94,16 @@ class YOLOV8Service:
         
         self.confidence_threshold = float(os.getenv("YOLOV8_CONFIDENCE", "0.5"))
         self.device = os.getenv("YOLOV8_DEVICE", "cpu")  # cpu, cuda, mps
+        # FP16 inference is only worthwhile (and supported) on CUDA devices
+        self.half = os.getenv("YOLOV8_HALF", "1" if self.device.startswith("cuda") else "0") == "1"
+        if self.device.startswith("cuda"):
+            # Let FP32 fallbacks (e.g. unsupported FP16 layers) use TF32 tensor cores
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.backends.cudnn.allow_tf32 = True
         self.model = None
+        # The Ultralytics predictor is not thread-safe; inference runs in worker
+        # threads (off the event loop) one call at a time
+        self._inference_lock = threading.Lock()
         print(f"[YOLOV8] About to load model...", flush=True)
         print(f"[YOLOV8] Model path before load: {self.model_path}", flush=True)
         print(f"[YOLOV8] Project root: {self.project_root}", flush=True)
@@ -175,6 +185,9 @@ class YOLOV8Service:
             # Always try project root first (most reliable location)
             model_loaded = False
             default_model = self.project_root / "yolov8n.pt"
+            # An explicitly configured model (e.g. an exported TensorRT .engine) takes precedence
+            if os.getenv("YOLOV8_MODEL_PATH") and self.model_path:
+                default_model = self.model_path
             default_model_str = str(default_model)
             default_model_exists = default_model.exists()
             print(f"[YOLOV8] First checking project root: {default_model_str}", flush=True)
@@ -238,7 +251,9 @@ class YOLOV8Service:
             
             # Move model to specified device (only if model was loaded)
             if self.model is not None:
-                self.model.to(self.device)
+                # Exported backends (.engine/.onnx) are bound to their device already
+                if isinstance(self.model.model, torch.nn.Module):
+                    self.model.to(self.device)
                 logger.info(f"✅ YOLOV8 model loaded successfully on {self.device}")
                 print(f"[YOLOV8] ✅ Model loaded successfully on {self.device}", flush=True)
             else:
@@ -265,87 +280,95 @@ class YOLOV8Service:
                 logger.error(traceback.format_exc())
                 self.model = None
     
-    async def preprocess_image(self, image_bytes: bytes) -> bytes:
+    def _decode_image(self, image_bytes: bytes) -> Optional[Image.Image]:
         """
-        Preprocess image for YOLOV8 analysis
+        Decode image bytes once into an RGB image for YOLOV8.
+        Ultralytics letterboxes/normalizes the decoded image itself, so there is
+        no JPEG re-encode or temp file round trip before inference.
         """
         try:
-            # Convert bytes to PIL Image
             image = Image.open(io.BytesIO(image_bytes))
-            
-            # Resize if needed (YOLOV8 typically expects specific input sizes)
-            # Example: image = image.resize((640, 640))
-            
-            # Convert back to bytes
-            img_byte_arr = io.BytesIO()
-            image.save(img_byte_arr, format='JPEG')
-            return img_byte_arr.getvalue()
+            return image.convert("RGB")
             
         except Exception as e:
             logger.error(f"Image preprocessing error: {e}")
-            return image_bytes  # Return original if preprocessing fails
+            return None
     
-    async def detect_objects(self, image_bytes: bytes) -> List[Dict[str, Any]]:
+    def _detect_many(self, images_bytes: List[bytes]) -> List[List[Dict[str, Any]]]:
         """
-        Detect objects in image using YOLOV8
+        Decode every image and run YOLOV8 once over the batch, all on the calling
+        (worker) thread. Returns one detection list per input, in order; images
+        that fail to decode get no detections.
         """
+        if not self.model:
+            logger.warning("YOLOV8 model not loaded, returning empty detections")
+            return [[] for _ in images_bytes]
+        decoded = [self._decode_image(image_bytes) for image_bytes in images_bytes]
+        valid = [image for image in decoded if image is not None]
         try:
-            if not self.model:
-                logger.warning("YOLOV8 model not loaded, returning empty detections")
-                print(f"[YOLOV8] ERROR: Model is None when detect_objects called!", flush=True)
-                print(f"[YOLOV8] Project root: {self.project_root}", flush=True)
-                print(f"[YOLOV8] Model path: {self.model_path}", flush=True)
-                print(f"[YOLOV8] Device: {self.device}", flush=True)
-                return []
-            
-            # Save image bytes to temporary file for YOLOV8 processing
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-                temp_file.write(image_bytes)
-                temp_path = temp_file.name
-            
-            try:
-                # Run YOLOV8 inference
-                results = self.model(temp_path, conf=self.confidence_threshold)
-                
-                detections = []
-                for result in results:
-                    if result.boxes is not None:
-                        for box in result.boxes:
-                            # Get class name from model
-                            class_id = int(box.cls.item())
-                            class_name = self.model.names[class_id]
-                            confidence = float(box.conf.item())
-                            
-                            # Get bounding box coordinates
-                            bbox = box.xyxy.tolist()[0]  # [x1, y1, x2, y2]
-                            
-                            detections.append({
-                                "class_id": class_id,
-                                "class": class_name,
-                                "confidence": confidence,
-                                "bbox": bbox,
-                                "description": f"{class_name} detected with {confidence:.2f} confidence"
-                            })
+            # Ultralytics letterboxes each image and runs the list as one batch
+            results = iter(self._predict(valid) if valid else [])
+            return [
+                self._detections_from_result(next(results)) if image is not None else []
+                for image in decoded
+            ]
+        except Exception as e:
+            logger.error(f"YOLOV8 batch detection error: {e}")
+            return [[] for _ in images_bytes]
+    
+    def _detections_from_result(self, result) -> List[Dict[str, Any]]:
+        detections = []
+        if result.boxes is not None:
+            for box in result.boxes:
+                # Get class name from model
+                class_id = int(box.cls.item())
+                class_name = self.model.names[class_id]
+                confidence = float(box.conf.item())
                 
-                return detections
+                # Get bounding box coordinates
+                bbox = box.xyxy.tolist()[0]  # [x1, y1, x2, y2]
                 
-            finally:
-                # Clean up temporary file
-                if os.path.exists(temp_path):
-                    os.unlink(temp_path)
-            
+                detections.append({
+                    "class_id": class_id,
+                    "class": class_name,
+                    "confidence": confidence,
+                    "bbox": bbox,
+                    "description": f"{class_name} detected with {confidence:.2f} confidence"
+                })
+        return detections
+    
+    def _predict(self, image):
+        """
+        Blocking forward pass on one image or a list of images (one batch).
+        Called from worker threads (asyncio.to_thread), one call at a time.
+        """
+        with self._inference_lock:
+            return self.model(image, conf=self.confidence_threshold, half=self.half)
+    
+    def warmup(self) -> None:
+        """
+        Run one dummy inference so predictor setup (and TensorRT/cuDNN kernel
+        selection) happens at startup instead of on the first request
+        """
+        if not self.model:
+            return
+        try:
+            self._predict(Image.new("RGB", (640, 640)))
+            print(f"[YOLOV8] ✅ Warmup inference complete", flush=True)
         except Exception as e:
-            logger.error(f"YOLOV8 detection error: {e}")
-            return []
+            logger.error(f"YOLOV8 warmup failed: {e}")
     
     async def extract_entrance_region(self, image_bytes: bytes, detections: List[Dict[str, Any]]) -> Optional[bytes]:
         """
         Extract entrance region from image based on YOLOV8 detections
         """
+        if not detections:
+            return None
+        # Decode, crop and JPEG re-encode in a worker thread
+        return await asyncio.to_thread(self._crop_entrance, image_bytes, detections)
+    
+    def _crop_entrance(self, image_bytes: bytes, detections: List[Dict[str, Any]]) -> Optional[bytes]:
         try:
-            if not detections:
-                return None
-            
             # Find the most confident entrance detection
             entrance_detection = max(detections, key=lambda x: x.get("confidence", 0))
             
@@ -368,54 +391,65 @@ class YOLOV8Service:
             logger.error(f"Entrance region extraction error: {e}")
             return None
     
+    def _features_from_detections(self, detections: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # Analyze accessibility features
+        accessibility_features = {
+            "ramp_detected": False,
+            "stairs_detected": False,
+            "door_detected": False,
+            "entrance_detected": False,
+            "confidence_scores": {},
+            "detections": detections
+        }
+        
+        # Process detections to identify accessibility features
+        for detection in detections:
+            class_name = detection.get("class", "").lower()
+            confidence = detection.get("confidence", 0)
+            
+            # Check for accessibility-related objects
+            if any(keyword in class_name for keyword in ["ramp", "slope", "incline"]):
+                accessibility_features["ramp_detected"] = True
+                accessibility_features["confidence_scores"]["ramp"] = confidence
+            elif any(keyword in class_name for keyword in ["stair", "step", "stairs", "steps"]):
+                accessibility_features["stairs_detected"] = True
+                accessibility_features["confidence_scores"]["stairs"] = confidence
+            elif any(keyword in class_name for keyword in ["door", "entrance", "entry"]):
+                accessibility_features["door_detected"] = True
+                accessibility_features["confidence_scores"]["door"] = confidence
+                if "entrance" in class_name or "entry" in class_name:
+                    accessibility_features["entrance_detected"] = True
+                    accessibility_features["confidence_scores"]["entrance"] = confidence
+            
+            # Also check for general building/entrance objects
+            if any(keyword in class_name for keyword in ["building", "house", "entrance", "door"]):
+                if not accessibility_features["entrance_detected"]:
+                    accessibility_features["entrance_detected"] = True
+                    accessibility_features["confidence_scores"]["entrance"] = confidence
+        
+        return accessibility_features
+    
+    async def analyze_accessibility_features_batch(self, images_bytes: List[bytes]) -> List[Dict[str, Any]]:
+        """
+        Batched analyze_accessibility_features: decode every image, run YOLOV8
+        once over all of them, and return one feature dict per input, in order.
+        Images that fail to decode get empty detections.
+        """
+        if not images_bytes:
+            return []
+        batch_detections = await asyncio.to_thread(self._detect_many, images_bytes)
+        return [self._features_from_detections(detections) for detections in batch_detections]
+    
     async def analyze_accessibility_features(self, image_bytes: bytes) -> Dict[str, Any]:
         """
         Analyze image for accessibility features using YOLOV8
         This method should detect ramps, stairs, doors, etc.
         """
         try:
-            # Preprocess image
-            processed_image = await self.preprocess_image(image_bytes)
-            
-            # Detect objects
-            detections = await self.detect_objects(processed_image)
-            
-            # Analyze accessibility features
-            accessibility_features = {
-                "ramp_detected": False,
-                "stairs_detected": False,
-                "door_detected": False,
-                "entrance_detected": False,
-                "confidence_scores": {},
-                "detections": detections
-            }
-            
-            # Process detections to identify accessibility features
-            for detection in detections:
-                class_name = detection.get("class", "").lower()
-                confidence = detection.get("confidence", 0)
-                
-                # Check for accessibility-related objects
-                if any(keyword in class_name for keyword in ["ramp", "slope", "incline"]):
-                    accessibility_features["ramp_detected"] = True
-                    accessibility_features["confidence_scores"]["ramp"] = confidence
-                elif any(keyword in class_name for keyword in ["stair", "step", "stairs", "steps"]):
-                    accessibility_features["stairs_detected"] = True
-                    accessibility_features["confidence_scores"]["stairs"] = confidence
-                elif any(keyword in class_name for keyword in ["door", "entrance", "entry"]):
-                    accessibility_features["door_detected"] = True
-                    accessibility_features["confidence_scores"]["door"] = confidence
-                    if "entrance" in class_name or "entry" in class_name:
-                        accessibility_features["entrance_detected"] = True
-                        accessibility_features["confidence_scores"]["entrance"] = confidence
-                
-                # Also check for general building/entrance objects
-                if any(keyword in class_name for keyword in ["building", "house", "entrance", "door"]):
-                    if not accessibility_features["entrance_detected"]:
-                        accessibility_features["entrance_detected"] = True
-                        accessibility_features["confidence_scores"]["entrance"] = confidence
+            # Decode and detect in one worker-thread hop
+            detections = (await asyncio.to_thread(self._detect_many, [image_bytes]))[0]
             
-            return accessibility_features
+            return self._features_from_detections(detections)
             
         except Exception as e:
             logger.error(f"Accessibility feature analysis error: {e}")
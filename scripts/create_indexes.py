@@ -1,7 +1,11 @@
-import asyncio, os
+import asyncio, os, sys
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 
+# Allow running as `python scripts/create_indexes.py` from the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.db import ensure_indexes
+
 load_dotenv()
 MONGO_URI=os.getenv("MONGO_URI")
 DB_NAME=os.getenv("DB_NAME","wheel_city")
@@ -9,11 +13,8 @@ DB_NAME=os.getenv("DB_NAME","wheel_city")
 async def main():
     client=AsyncIOMotorClient(MONGO_URI)
     db=client[DB_NAME]
-    await db.shops.create_index([("location", "2dsphere")])
-    await db.shops.create_index([("name", "text")])
-    await db.reviews.create_index([("shop_id", 1), ("created_at", -1)])
-    await db.reviews.create_index([("user_id", 1), ("created_at", -1)])
-    await db.users.create_index([("auth_id", 1)], unique=True)
+    # Same index list (app.db.INDEXES) the API ensures at startup
+    await ensure_indexes(db)
 
     print("Indexes created")
     client.close()
@@ -1,5 +1,5 @@
 import asyncio, os
-from datetime import datetime
+from datetime import datetime, timezone
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 load_dotenv()
@@ -50,7 +50,7 @@ async def main():
             "ai_correct": {"ramp": True, "curb": False},
             "photo_urls": [],
             "review_text": "친절하고 진입이 쉬웠어요.",
-            "created_at": datetime.utcnow(),
+            "created_at": datetime.now(timezone.utc),
         }
     )
 